@@ -6,24 +6,38 @@ Generates topics and content using Google Gemini API, then sends via Gmail to Wo
 
 import os
 import time
+import atexit
 import json
 import logging
 import sys
-from dotenv import load_dotenv
 import re
-import smtplib
+import hashlib
+import math
+import html
+import shelve
+import threading
 import argparse
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+import functools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-# --- Google GenAI (Gemini) client
-from google import genai
+# google.genai, dotenv, smtplib and email.message are imported where they are
+# used; google.genai in particular adds hundreds of ms to start-up.
+from pydantic import BaseModel, ValidationError
+
+try:
+    import orjson
+except ImportError:  # optional speed-up; stdlib json is used instead
+    orjson = None
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 
+# Set LOAD_DOTENV=0 when the environment is provided some other way (cron,
+# containers) to skip importing python-dotenv and reading .env
 try:
-    if os.getenv("GITHUB_ACTIONS") != "true":
+    if os.getenv("GITHUB_ACTIONS") != "true" and os.getenv("LOAD_DOTENV", "1") == "1":
+        from dotenv import load_dotenv
         load_dotenv()
 except Exception:
     logging.debug("No .env loaded; relying on environment variables")
@@ -35,7 +49,62 @@ if not GENAI_API_KEY:
     logging.error("Missing GEMINI_API_KEY")
     raise SystemExit(1)
 
-client = genai.Client(api_key=GENAI_API_KEY)
+@functools.cache
+def _get_client():
+    """Return the Gemini client, creating it (and importing google.genai) on first use."""
+    from google import genai
+    return genai.Client(api_key=GENAI_API_KEY)
+
+
+@functools.cache
+def _generation_config(timeout=None, **kwargs):
+    """Build a GenerateContentConfig for a Gemini request.
+
+    ``timeout`` (seconds, see _request_timeout) is sent as the server-side
+    deadline for the whole request and also bounds each network operation,
+    so a stalled request fails instead of hanging. Leave it unset for batch
+    jobs, which are polled instead. Configs are memoized per argument set
+    and shared, so callers must not modify them.
+    """
+    from google.genai import types
+    if timeout is not None:
+        kwargs["http_options"] = types.HttpOptions(timeout=int(timeout * 1000))
+    return types.GenerateContentConfig(**kwargs)
+
+
+# Request deadlines must cover a full generation: the SDK sends the timeout
+# as the server-side deadline of the whole request, not only as a read
+# timeout. A request that still times out is re-issued, up to
+# REQUEST_RETRIES times with exponential backoff.
+REQUEST_TIMEOUT_BASE = 30  # seconds, on top of the time to generate the output
+MIN_OUTPUT_TOKENS_PER_SECOND = 50  # slow end of Gemini Flash output speed
+REQUEST_RETRIES = 2
+
+
+def _request_timeout(max_output_tokens, candidates=1):
+    """Deadline in seconds for a request producing up to this many tokens."""
+    return REQUEST_TIMEOUT_BASE + math.ceil(max_output_tokens * candidates / MIN_OUTPUT_TOKENS_PER_SECOND)
+
+# Route the combined topic+post request through the (cheaper, asynchronous)
+# Batch API. Follow-up repairs (placeholder regeneration, continuations,
+# two-step fallbacks) stay synchronous so one run waits on a single job.
+# Suited to the scheduled run; leave unset for interactive use.
+BATCH_MODE = os.getenv("BATCH_MODE") == "1"
+BATCH_POLL_INTERVAL = 30  # seconds between batch job status checks
+# Longest wait for a batch job before it is cancelled and the posts are
+# generated synchronously instead. Keep it under the CI job time limit.
+try:
+    BATCH_MAX_WAIT = int(os.getenv("BATCH_MAX_WAIT", str(3 * 60 * 60)))
+except ValueError:
+    logging.error("BATCH_MAX_WAIT must be a number of seconds, got %r", os.getenv("BATCH_MAX_WAIT"))
+    raise SystemExit(1)
+_BATCH_DONE_STATES = {
+    "JOB_STATE_SUCCEEDED",
+    "JOB_STATE_PARTIALLY_SUCCEEDED",
+    "JOB_STATE_FAILED",
+    "JOB_STATE_CANCELLED",
+    "JOB_STATE_EXPIRED",
+}
 
 # Category list for topic diversification
 TECH_CATEGORIES = [
@@ -53,13 +122,449 @@ TECH_CATEGORIES = [
 
 # File to track topic history and category rotation
 TOPIC_TRACKER_FILE = "topic_tracker.json"
+# Serializes tracker file access across generation worker threads
+_tracker_lock = threading.RLock()
+
+# Patterns used to clean model output, compiled once at import
+_HTML_TAG = re.compile(r'<[^>]+>')
+_CODE_FENCE_OPEN = re.compile(r'^```[^\n]*\n')
+_CODE_FENCE_CLOSE = re.compile(r'\n```$')
+_PLACEHOLDER = re.compile(r'\bCODEBLOCK_\d+\b')
+# Words of a topic used as fallback tags; keeps names like C++, C#, Node.js
+# whole and drops surrounding punctuation ("Python:" -> "Python")
+_TAG_WORD = re.compile(r'[A-Za-z][A-Za-z0-9]*(?:[+#]+|[.\-][A-Za-z0-9]+)*')
+_TAG_STOPWORDS = frozenset(
+    "a an and are as at by for from how in into is of on or the to vs why with your".split()
+)
+
+# Markdown -> HTML conversion patterns
+_HEADING_PREFIX = re.compile(r'^#+\s*')
+_BULLET_PREFIX = re.compile(r'^\*\s*')
+# One pass for all inline markup: ***bold italic***, **bold**, *italic*
+# (which may contain **bold**) and `code`. Code spans are left verbatim.
+_INLINE = re.compile(
+    r'\*\*\*([^*]+)\*\*\*'
+    r'|\*\*([^*]+)\*\*'
+    r'|\*(?!\*)((?:[^*]|\*\*[^*]+\*\*)+)\*(?!\*)'
+    r'|`([^`]+)`'
+)
+
+# How many recently sent post bodies are remembered to skip exact re-sends
+RECENT_POST_HASHES = 200
+
+# Append-only log of published posts
+PUBLISH_LOG_FILE = "publish_log.jsonl"
+
+# Local cache of Gemini responses (see LLMCache)
+LLM_CACHE_FILE = "gemini_cache.db"
+TOPIC_CACHE_TTL = 60 * 60        # 1 hour
+POST_CACHE_TTL = 24 * 60 * 60    # 24 hours
+
+# Number of posts generated (and published) per run
+try:
+    N_POSTS_PER_RUN = int(os.getenv("N_POSTS_PER_RUN", "1"))
+except ValueError:
+    N_POSTS_PER_RUN = 0
+if N_POSTS_PER_RUN < 1:
+    logging.error("N_POSTS_PER_RUN must be a positive integer, got %r", os.getenv("N_POSTS_PER_RUN"))
+    raise SystemExit(1)
+
+# Output token ceiling of the Gemini model
+MODEL_MAX_OUTPUT_TOKENS = 8192
+# Upper bound on Gemini requests in flight at once from the per-post worker pools
+MAX_CONCURRENT_REQUESTS = 4
+# Alternative bodies requested in the single regeneration call when a post
+# comes back with CODEBLOCK_N placeholders
+PLACEHOLDER_REGEN_CANDIDATES = 3
+
+
+# Prompt templates. The invariant instructions come first and the per-call
+# values last, so the long prefix is byte-identical across requests and can
+# be served from Gemini's implicit prompt cache.
+_TOPIC_PROMPT_TMPL = """You are an expert technical content strategist for a developer blog. Generate ONE fresh, compelling blog topic (6-12 words) that appeals to software developers and engineers.
+
+CRITERIA:
+- Must be practical and actionable for working developers
+- Avoid basic/introductory topics unless there's a novel angle
+- Ensure topics are evergreen enough to remain relevant
+- Focus on problems developers actually face
+- Use different angles than the recent topics listed below
+- Be specific and compelling (6-12 words)
+
+Return ONLY the topic/title as plain text with no additional commentary.
+
+YOU MUST FOLLOW THIS RULE:
+**The topic MUST be about: {category}**
+Pick a specific subtopic or angle within this category, but stay within {category}.
+
+RECENT TOPICS TO AVOID (do NOT repeat):
+{recent_topics}"""
+
+# The topic is appended verbatim, so this one is a plain prefix, not a template
+_POST_PROMPT_PREFIX = """Write a 500-1000 word blog post about the topic given at the end of this prompt.
+
+AUDIENCE & TONE:
+- Write for software developers and engineers
+- Use an engaging, conversational tone
+- Explain complex topics in an understandable way
+- Include practical examples
+
+FORMATTING FOR WORDPRESS POST-BY-EMAIL (CRITICAL):
+The output will be sent as plain text email to WordPress. Use this EXACT markdown format:
+
+Section Headers: Use # for main sections (will be converted to bold)
+Example:
+# Why This Matters
+
+Emphasis: Use *text* for italics (single asterisks) and **text** for bold
+Example: This is *important* and this is **bold** using asterisks
+
+Code Blocks: ALWAYS use triple backticks with language name
+```bash
+echo "example bash command"
+```
+
+```yaml
+apiVersion: v1
+kind: Pod
+```
+
+```python
+def example():
+    print("python code")
+```
+
+Bullet Points: Use * at start of line
+* First item
+* Second item
+
+Paragraphs: Separate with blank lines (double newline)
+
+CONTENT REQUIREMENTS:
+- Start directly with content (skip introductions)
+- Include 3-5 real, working code examples with proper syntax
+- Each code block MUST have correct language identifier (bash, yaml, python, javascript, etc)
+- Each code example must be complete and functional
+- Use inline backticks for code references: `kubectl`, `variable_name`, etc.
+
+ABSOLUTELY FORBIDDEN:
+- NO HTML tags at all (<p>, <strong>, <h1>, etc.)
+- NO placeholder text like "code example here"
+- NO CODEBLOCK_0, CODEBLOCK_1 tokens
+- NO empty code blocks
+
+REQUIRED OUTPUT:
+- Plain text only
+- Proper markdown with # headings, * bullets, ``` code blocks
+- Minimum 3-4 real code examples
+- Every code block has language name
+- Double line breaks between major sections
+
+TOPIC: """
+
+_TOPICS_AND_POSTS_PROMPT_TMPL = """You are an expert technical content strategist and writer for a developer blog. For each category listed at the end of this prompt, first pick ONE fresh, compelling blog topic (6-12 words), then write a 500-1000 word blog post about it.
+
+TOPIC RULES:
+**Each topic MUST be about its category.**
+Pick a specific subtopic or angle within the category, but stay within it. Every topic must be different.
+
+TOPIC CRITERIA:
+- Must be practical and actionable for working developers
+- Avoid basic/introductory topics unless there's a novel angle
+- Ensure topics are evergreen enough to remain relevant
+- Focus on problems developers actually face
+- Use different angles than the recent topics listed below
+- Be specific and compelling (6-12 words)
+
+AUDIENCE & TONE:
+- Write for software developers and engineers
+- Use an engaging, conversational tone
+- Explain complex topics in an understandable way
+- Include practical examples
+
+FORMATTING FOR WORDPRESS POST-BY-EMAIL (CRITICAL):
+The body will be sent as an email to WordPress. Write it in this EXACT markdown format:
+
+Section Headers: Use # for main sections
+Emphasis: Use *text* for italics (single asterisks) and **text** for bold
+Code Blocks: ALWAYS use triple backticks with language name (```bash, ```yaml, ```python, ...)
+Bullet Points: Use * at start of line
+Paragraphs: Separate with blank lines (double newline)
+
+CONTENT REQUIREMENTS:
+- Start directly with content (skip introductions)
+- Include 3-5 real, working code examples with proper syntax
+- Each code block MUST have correct language identifier (bash, yaml, python, javascript, etc)
+- Each code example must be complete and functional
+- Use inline backticks for code references: `kubectl`, `variable_name`, etc.
+
+ABSOLUTELY FORBIDDEN:
+- NO HTML tags at all (<p>, <strong>, <h1>, etc.)
+- NO placeholder text like "code example here"
+- NO CODEBLOCK_0, CODEBLOCK_1 tokens
+- NO empty code blocks
+
+REQUIRED OUTPUT:
+Return a JSON array with one object per category, in the order listed. Each object has these fields:
+- "topic": the topic you picked
+- "title": the post title (usually the topic itself)
+- "body_html": the full markdown post body
+- "tags": 3-5 short lowercase tags
+
+Write {n_posts} blog post(s).
+
+CATEGORIES (one post per line, in this order):
+{categories}
+
+RECENT TOPICS TO AVOID (do NOT repeat):
+{recent_topics}"""
+
+
+class GeneratedPost(BaseModel):
+    """One entry of the combined topic + post response (also its response_schema)."""
+    topic: str
+    title: str
+    body_html: str  # markdown; the name is kept for publish_via_gmail
+    tags: list[str]
+
+
+def _generate_text(model, contents, config):
+    """Call Gemini and return the response text, streamed as it is generated."""
+    return _generate_text_until(model, contents, config, None)[0]
+
+
+def _generate_text_until(model, contents, config, stop_at, batch=False):
+    """Like _generate_text, but give up on the response once ``stop_at`` matches.
+
+    If the compiled pattern ``stop_at`` shows up in the streamed output, the
+    stream is abandoned so the caller can react without waiting for the rest
+    of a response it will discard. Returns ``(text, stopped)``, where
+    ``stopped`` tells whether the text was actually cut short. With
+    ``batch`` the request is instead submitted as a single inline Batch API
+    job (see _run_batch_request), whose response always arrives whole.
+    """
+    if not batch:
+        return _call_with_retries(_stream_text, model, contents, config, stop_at)
+
+    return _run_batch_request(model, contents, config).text or "", False
+
+
+def _stream_text(model, contents, config, stop_at):
+    chunks = []
+    tail = ""  # end of the previous chunk, for matches split across chunks
+    stream = _get_client().models.generate_content_stream(model=model, contents=contents, config=config)
+    for chunk in stream:
+        if not chunk.text:
+            continue
+        chunks.append(chunk.text)
+        # A match in the final chunk (the one with a finish_reason) leaves
+        # nothing to save by stopping, and the text is complete
+        finished = bool(chunk.candidates and chunk.candidates[0].finish_reason)
+        if stop_at is not None and not finished:
+            window = tail + chunk.text
+            if stop_at.search(window):
+                logging.info("Stopping the response stream early: output matched %r", stop_at.pattern)
+                stream.close()
+                return "".join(chunks), True
+            tail = window[-64:]
+    return "".join(chunks), False
+
+
+def _call_with_retries(fn, *args, retries=REQUEST_RETRIES):
+    """Call fn(*args), re-issuing it with exponential backoff if it times out.
+
+    Both a client-side timeout and the server's deadline-exceeded (504)
+    response count as timeouts.
+    """
+    import httpx  # transport of google-genai; imported with it, on first request
+    from google.genai import errors
+
+    for attempt in range(retries + 1):
+        try:
+            return fn(*args)
+        except (httpx.TimeoutException, errors.APIError) as e:
+            if isinstance(e, errors.APIError) and e.code != 504 or attempt == retries:
+                raise
+            delay = 2 ** attempt
+            logging.warning(
+                "Gemini request timed out (%s); retrying in %ds (%d/%d)", e, delay, attempt + 1, retries
+            )
+            time.sleep(delay)
+
+
+def _generate_candidates(model, contents, config):
+    """Call Gemini and return the text of every candidate, in candidate order.
+
+    Used with ``candidate_count`` > 1 so several alternative answers cost a
+    single round trip.
+    """
+    return _call_with_retries(_stream_candidates, model, contents, config)
+
+
+def _stream_candidates(model, contents, config):
+    texts = {}
+    for chunk in _get_client().models.generate_content_stream(model=model, contents=contents, config=config):
+        for candidate in chunk.candidates or []:
+            texts.setdefault(candidate.index or 0, []).append(_candidate_text(candidate))
+    return ["".join(texts[index]) for index in sorted(texts)]
+
+
+def _candidate_text(candidate):
+    parts = candidate.content.parts if candidate.content and candidate.content.parts else []
+    return "".join(part.text for part in parts if part.text and not part.thought)
+
+
+def _run_batch_request(model, contents, config):
+    """Submit one request as an inline Batch API job and wait for its response.
+
+    Batch jobs target a 24-hour turnaround. A job still running after
+    BATCH_MAX_WAIT seconds is cancelled and TimeoutError raised.
+    """
+    job = _get_client().batches.create(
+        model=model,
+        src=[{"contents": [{"role": "user", "parts": [{"text": contents}]}], "config": config}],
+    )
+    logging.info("Submitted Gemini batch job %s", job.name)
+    deadline = time.monotonic() + BATCH_MAX_WAIT
+    while job.state.name not in _BATCH_DONE_STATES:
+        if time.monotonic() >= deadline:
+            try:
+                _get_client().batches.cancel(name=job.name)
+            except Exception as e:
+                logging.warning("Could not cancel Gemini batch job %s: %s", job.name, e)
+            raise TimeoutError(f"Gemini batch job {job.name} did not finish within {BATCH_MAX_WAIT}s")
+        time.sleep(BATCH_POLL_INTERVAL)
+        job = _get_client().batches.get(name=job.name)
+        logging.debug("Batch job %s state: %s", job.name, job.state.name)
+
+    # One inline request: a partial success is judged by its own error below
+    if job.state.name not in ("JOB_STATE_SUCCEEDED", "JOB_STATE_PARTIALLY_SUCCEEDED"):
+        raise RuntimeError(f"Gemini batch job {job.name} ended in state {job.state.name}: {job.error}")
+    inlined = job.dest.inlined_responses[0]
+    if inlined.error:
+        raise RuntimeError(f"Gemini batch job {job.name} request failed: {inlined.error}")
+    return inlined.response
+
+
+class LLMCache:
+    """Persistent cache of Gemini response text, keyed by request.
+
+    Entries live in a shelve database so repeated runs (development,
+    re-running after a failed publish) skip the API call entirely. Entries
+    older than ``max_age`` seconds, the longest ttl any caller reads with,
+    are deleted on each write.
+    """
+
+    def __init__(self, path=LLM_CACHE_FILE, max_age=POST_CACHE_TTL):
+        self.path = path
+        self.max_age = max_age
+        # dbm files are not safe to open concurrently from several threads
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model, prompt, cfg):
+        # default=repr covers non-JSON config values such as response_schema types
+        payload = json.dumps({"model": model, "prompt": prompt, "cfg": cfg}, sort_keys=True, default=repr)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key, ttl):
+        """Return the cached text for key, or None if missing or older than ttl seconds."""
+        try:
+            with self._lock, shelve.open(self.path) as db:
+                entry = db.get(key)
+        except Exception as e:
+            logging.debug("LLM cache read failed: %s", e)
+            return None
+        if entry and time.time() - entry["ts"] < ttl:
+            return entry["text"]
+        return None
+
+    def set(self, key, text):
+        now = time.time()
+        try:
+            with self._lock, shelve.open(self.path) as db:
+                db[key] = {"text": text, "ts": now}
+                # Prompts change every run (the recent-topics list does), so
+                # expired entries would otherwise pile up forever
+                for stale in [k for k, entry in db.items() if now - entry["ts"] >= self.max_age]:
+                    del db[stale]
+        except Exception as e:
+            logging.debug("LLM cache write failed: %s", e)
+
+
+llm_cache = LLMCache()
+
+
+def cached_generate(model, prompt, config, ttl, batch=False):
+    """Return Gemini's response text for prompt, served from llm_cache when fresh."""
+    return cached_generate_until(model, prompt, config, ttl, None, batch=batch)[0]
+
+
+def cached_generate_until(model, prompt, config, ttl, stop_at, batch=False):
+    """Like cached_generate, but stop the response early where ``stop_at`` matches.
+
+    Returns ``(text, stopped)`` as _generate_text_until does. Text cut short
+    is not cached; a complete response is, placeholders or not.
+    """
+    # Transport settings such as the timeout do not change the answer
+    cfg = config.model_dump(exclude_none=True, exclude={"http_options"})
+    key = LLMCache.make_key(model, prompt, cfg)
+    text = llm_cache.get(key, ttl)
+    if text is not None:
+        logging.info("LLM cache hit (%s)", key[:12])
+        return text, False
+
+    text, stopped = _generate_text_until(model, prompt, config, stop_at, batch=batch)
+    if text.strip() and not stopped:
+        llm_cache.set(key, text)
+    return text, stopped
+
+
+def _json_loads(text):
+    """Parse JSON with orjson when available (raises json.JSONDecodeError either way)."""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def _json_line(obj):
+    """Serialize obj as one UTF-8 JSON line for an append-only .jsonl file."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(obj) + "\n").encode("utf-8")
+
+
+_publish_log_fh = None
+
+
+def _append_publish_log(record):
+    """Append one record to the publish log.
+
+    The file is opened once per process with O_APPEND and no buffering, so
+    each record is a single atomic write() even with concurrent writers. It
+    is fsynced once, at exit, rather than after every record.
+    """
+    global _publish_log_fh
+    if _publish_log_fh is None:
+        fd = os.open(PUBLISH_LOG_FILE, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        _publish_log_fh = os.fdopen(fd, "ab", buffering=0)
+        atexit.register(_close_publish_log, _publish_log_fh)
+    _publish_log_fh.write(_json_line(record))
+
+
+def _close_publish_log(fh):
+    try:
+        os.fsync(fh.fileno())
+    except OSError as e:
+        logging.debug("Publish log fsync failed: %s", e)
+    fh.close()
 
 
 def _load_topic_tracker():
     """Load or initialize the topic tracker file."""
     if Path(TOPIC_TRACKER_FILE).exists():
         try:
-            with open(TOPIC_TRACKER_FILE, 'r') as f:
+            with _tracker_lock, open(TOPIC_TRACKER_FILE, 'r') as f:
                 return json.load(f)
         except Exception as e:
             logging.warning("Failed to load topic tracker: %s. Starting fresh.", e)
@@ -76,83 +581,113 @@ def _load_topic_tracker():
 def _save_topic_tracker(tracker):
     """Save the topic tracker to file."""
     try:
-        with open(TOPIC_TRACKER_FILE, 'w') as f:
+        with _tracker_lock, open(TOPIC_TRACKER_FILE, 'w') as f:
             json.dump(tracker, f, indent=2)
     except Exception as e:
         logging.error("Failed to save topic tracker: %s", e)
 
 
-def _get_next_category():
-    """Get the next category for topic generation using round-robin rotation."""
+def _post_hash(body_text):
+    return hashlib.sha256(body_text.encode("utf-8")).hexdigest()
+
+
+def _was_recently_sent(body_hash):
+    """Whether a post with this body hash is among the last RECENT_POST_HASHES sent."""
+    return body_hash in set(_load_topic_tracker().get("recent_post_hashes", []))
+
+
+def _remember_sent_post(body_hash):
+    """Record a sent post's body hash, keeping only the newest RECENT_POST_HASHES."""
+    # Generation threads may still be recording topics while posts are sent
+    with _tracker_lock:
+        tracker = _load_topic_tracker()
+        hashes = deque(tracker.get("recent_post_hashes", []), maxlen=RECENT_POST_HASHES)
+        hashes.append(body_hash)
+        tracker["recent_post_hashes"] = list(hashes)
+        _save_topic_tracker(tracker)
+
+
+def _get_next_categories(count):
+    """Get the next ``count`` categories using round-robin rotation."""
     tracker = _load_topic_tracker()
-    category_idx = tracker.get("next_category_index", 0) % len(TECH_CATEGORIES)
-    category = TECH_CATEGORIES[category_idx]
-    
+    start_idx = tracker.get("next_category_index", 0) % len(TECH_CATEGORIES)
+    categories = []
+    for offset in range(count):
+        category_idx = (start_idx + offset) % len(TECH_CATEGORIES)
+        categories.append(TECH_CATEGORIES[category_idx])
+        logging.info(f"Category rotation: {TECH_CATEGORIES[category_idx]} (index {category_idx + 1}/{len(TECH_CATEGORIES)})")
+
     # Update rotation index
-    tracker["next_category_index"] = (category_idx + 1) % len(TECH_CATEGORIES)
+    tracker["next_category_index"] = (start_idx + count) % len(TECH_CATEGORIES)
     _save_topic_tracker(tracker)
-    
-    logging.info(f"Category rotation: {category} (index {category_idx + 1}/{len(TECH_CATEGORIES)})")
-    return category
+    return categories
+
+
+def _get_next_category():
+    """Get the next category for topic generation using round-robin rotation."""
+    return _get_next_categories(1)[0]
+
+
+def _format_recent_topics(used_topics):
+    """Format the most recent topics as a bullet list for the prompt."""
+    recent_topics = used_topics[-20:] if used_topics else []  # Last 20 to avoid huge context
+    return "\n".join([f"- {t}" for t in recent_topics]) if recent_topics else "(none yet)"
 
 
-def choose_topic(max_retries=3, model="gemini-2.0-flash"):
+def _record_topic(topic, category=None):
+    """Add a topic to the history and bump its category count.
+
+    The tracker is re-read under a lock so posts generated on worker threads
+    neither overwrite each other's entries nor claim the same topic. Returns
+    False, leaving the tracker untouched, if the topic is already used.
+    """
+    with _tracker_lock:
+        tracker = _load_topic_tracker()
+        if topic in tracker["used_topics"]:
+            return False
+        tracker["used_topics"].append(topic)
+        if category is not None:
+            tracker["category_counts"][category] = tracker["category_counts"].get(category, 0) + 1
+        _save_topic_tracker(tracker)
+    return True
+
+
+def choose_topic(max_retries=3, model="gemini-2.0-flash", category=None):
     """Generate a fresh blog topic using category rotation + history tracking.
     
     This ensures:
     1. Category diversity - rotates through all 10 categories systematically
     2. Topic freshness - never generates the same topic twice
+
+    Pass ``category`` to reuse a category already taken from the rotation.
     """
     # Get next category from rotation
-    forced_category = _get_next_category()
+    forced_category = category or _get_next_category()
     
     # Load topic history
     tracker = _load_topic_tracker()
     used_topics = tracker.get("used_topics", [])
     
     # Format used topics for the prompt
-    recent_topics = used_topics[-20:] if used_topics else []  # Last 20 to avoid huge context
-    topics_text = "\n".join([f"- {t}" for t in recent_topics]) if recent_topics else "(none yet)"
+    topics_text = _format_recent_topics(used_topics)
     
-    prompt = f"""You are an expert technical content strategist for a developer blog. Generate ONE fresh, compelling blog topic (6-12 words) that appeals to software developers and engineers.
-
-YOU MUST FOLLOW THIS RULE:
-**The topic MUST be about: {forced_category}**
-Pick a specific subtopic or angle within this category, but stay within {forced_category}.
-
-RECENT TOPICS TO AVOID (do NOT repeat):
-{topics_text}
-
-CRITERIA:
-- Must be practical and actionable for working developers
-- Avoid basic/introductory topics unless there's a novel angle
-- Ensure topics are evergreen enough to remain relevant
-- Focus on problems developers actually face
-- Use different angles than the recent topics above
-- Be specific and compelling (6-12 words)
-
-Return ONLY the topic/title as plain text with no additional commentary."""
+    prompt = _TOPIC_PROMPT_TMPL.format(category=forced_category, recent_topics=topics_text)
 
+    config = _generation_config(max_output_tokens=40, timeout=_request_timeout(40))
     for attempt in range(max_retries):
         try:
-            response = client.models.generate_content(
-                model=model,
-                contents=prompt,
-                config=genai.types.GenerateContentConfig(max_output_tokens=40),
-            )
-            text = getattr(response, "text", None) or str(response)
+            if attempt == 0:
+                text = cached_generate(model, prompt, config, TOPIC_CACHE_TTL)
+            else:
+                # Retries must reach the model; the cached answer was rejected
+                text = _generate_text(model=model, contents=prompt, config=config)
             topic = next((ln.strip().strip('"').strip("'") for ln in text.splitlines() if ln.strip()), "")
             
-            if topic and topic not in used_topics:
+            # Save to history; fails if another post claimed the topic meanwhile
+            if topic and topic not in used_topics and _record_topic(topic, forced_category):
                 logging.info(f"✓ Generated topic (Category: {forced_category}): {topic}")
-                
-                # Save to history
-                tracker["used_topics"].append(topic)
-                tracker["category_counts"][forced_category] = tracker["category_counts"].get(forced_category, 0) + 1
-                _save_topic_tracker(tracker)
-                
                 return topic
-            elif topic in used_topics:
+            elif topic:
                 logging.warning(f"Topic already used: {topic}. Retrying...")
         except Exception as e:
             logging.debug(f"Topic generation attempt {attempt + 1} failed: {e}")
@@ -163,9 +698,7 @@ Return ONLY the topic/title as plain text with no additional commentary."""
     logging.warning(f"Topic generation failed after {max_retries} retries. Using fallback: {fallback}")
     
     # Save fallback to history
-    tracker = _load_topic_tracker()
-    tracker["used_topics"].append(fallback)
-    _save_topic_tracker(tracker)
+    _record_topic(fallback)
     
     return fallback
 
@@ -176,20 +709,21 @@ def _looks_truncated(text: str) -> bool:
     Returns True if the text ends abruptly (no terminal punctuation) or
     ends with an incomplete code fence marker. This is a heuristic only.
     """
-    if not text:
+    # Work on index bounds instead of rstrip()/splitlines() copies of the post
+    end = len(text)
+    while end and text[end - 1].isspace():
+        end -= 1
+    if not end:
         return True
-    text = text.rstrip()
     # If ends with common sentence terminators, assume complete
-    if text.endswith((".", "?", "!", '"', "'")):
+    if text.endswith((".", "?", "!", '"', "'"), 0, end):
         return False
     # If ends with a code fence start or backticks, consider truncated
-    if text.endswith("```)" ) or text.endswith("```"):
+    if text.endswith(("```", "```)"), 0, end):
         return True
     # Otherwise, if last line is very short (single word), suspect truncation
-    last_line = text.splitlines()[-1]
-    if len(last_line.split()) <= 4 and not last_line.endswith(('.', '?', '!')):
-        return True
-    return False
+    start = max(text.rfind("\n", 0, end), text.rfind("\r", 0, end)) + 1
+    return len(text[start:end].split()) <= 4
 
 
 def _replace_placeholder_tokens_with_fences(text: str) -> str:
@@ -203,101 +737,93 @@ def _replace_placeholder_tokens_with_fences(text: str) -> str:
         # This at least prevents the literal CODEBLOCK_N from appearing in the final output
         return f"```bash\n# {token} — code example would appear here\n```"
     
-    return re.sub(r'\bCODEBLOCK_\d+\b', replacer, text)
+    return _PLACEHOLDER.sub(replacer, text)
 
 
-def generate_post(topic, model="gemini-2.0-flash", max_output_tokens=3000, max_continue_attempts=3):
-    prompt = f"""Write a 500-1000 word blog post about: {topic}
-
-AUDIENCE & TONE:
-- Write for software developers and engineers
-- Use an engaging, conversational tone
-- Explain complex topics in an understandable way
-- Include practical examples
+def _clean_model_text(text, fences=True):
+    """Strip HTML tags and, with ``fences``, a code fence wrapping the whole text.
 
-FORMATTING FOR WORDPRESS POST-BY-EMAIL (CRITICAL):
-The output will be sent as plain text email to WordPress. Use this EXACT markdown format:
-
-Section Headers: Use # for main sections (will be converted to bold)
-Example:
-# Why This Matters
-
-Emphasis: Use *text* for italics (single asterisks) and **text** for bold
-Example: This is *important* and this is **bold** using asterisks
-
-Code Blocks: ALWAYS use triple backticks with language name
-```bash
-echo "example bash command"
-```
+    The prompts ask for plain markdown, so this only undoes what the model
+    adds despite them; usually there is nothing to remove.
+    """
+    if '<' in text:
+        # No tag can start after the last '>'; leaving that tail out stops the
+        # regex from rescanning it for every '<' in it (quadratic on code
+        # full of comparisons)
+        end = text.rfind('>') + 1
+        text = _HTML_TAG.sub('', text[:end]) + text[end:]
+    if fences:
+        if text.startswith("```"):
+            text = _CODE_FENCE_OPEN.sub('', text)
+        if text.endswith("```"):
+            text = _CODE_FENCE_CLOSE.sub('', text)
+    return text
 
-```yaml
-apiVersion: v1
-kind: Pod
-```
 
-```python
-def example():
-    print("python code")
-```
+def generate_post(topic, model="gemini-2.0-flash", max_output_tokens=3000, max_continue_attempts=3):
+    prompt = _POST_PROMPT_PREFIX + topic
+
+    # The finished post (after placeholder regeneration and continuation) is
+    # cached separately from the raw response so a repeat topic skips every
+    # follow-up call, not just the first one.
+    final_key = LLMCache.make_key(model, prompt, {"finalized": True, "max_output_tokens": max_output_tokens})
+    text = llm_cache.get(final_key, POST_CACHE_TTL)
+    if text is not None:
+        logging.info("Finalized post cache hit (%s)", final_key[:12])
+        return _post_dict(topic, text)
+
+    config = _generation_config(max_output_tokens=max_output_tokens, timeout=_request_timeout(max_output_tokens))
+
+    # A body with CODEBLOCK_N placeholders is regenerated anyway, so stop
+    # streaming it as soon as the first one appears. A body that was cut off
+    # is only fetched in full if regeneration fails and it must be published.
+    text, stopped = cached_generate_until(model, prompt, config, POST_CACHE_TTL, _PLACEHOLDER)
+    text = _clean_model_text(text.strip())
+
+    full_text = None
+    if stopped:
+        def full_text():
+            return _clean_model_text(cached_generate(model, prompt, config, POST_CACHE_TTL).strip())
+
+    text = _finalize_post_text(
+        topic, text, model, max_output_tokens, max_continue_attempts, full_text=full_text
+    )
+    if text.strip() and not _PLACEHOLDER.search(text):
+        llm_cache.set(final_key, text)
 
-Bullet Points: Use * at start of line
-* First item
-* Second item
+    return _post_dict(topic, text)
 
-Paragraphs: Separate with blank lines (double newline)
 
-CONTENT REQUIREMENTS:
-- Start directly with content (skip introductions)
-- Include 3-5 real, working code examples with proper syntax
-- Each code block MUST have correct language identifier (bash, yaml, python, javascript, etc)
-- Each code example must be complete and functional
-- Use inline backticks for code references: `kubectl`, `variable_name`, etc.
+def _topic_tags(topic, limit=4):
+    """Derive up to ``limit`` distinct lowercase tags from the topic's words."""
+    words = (m.group(0).lower() for m in _TAG_WORD.finditer(topic))
+    # dict.fromkeys de-duplicates while keeping the topic's word order
+    tags = dict.fromkeys(w for w in words if w not in _TAG_STOPWORDS)
+    return list(tags)[:limit]
 
-ABSOLUTELY FORBIDDEN:
-- NO HTML tags at all (<p>, <strong>, <h1>, etc.)
-- NO placeholder text like "code example here"
-- NO CODEBLOCK_0, CODEBLOCK_1 tokens
-- NO empty code blocks
 
-REQUIRED OUTPUT:
-- Plain text only
-- Proper markdown with # headings, * bullets, ``` code blocks
-- Minimum 3-4 real code examples
-- Every code block has language name
-- Double line breaks between major sections"""
-    
-    response = client.models.generate_content(
-        model=model,
-        contents=prompt,
-        config=genai.types.GenerateContentConfig(max_output_tokens=max_output_tokens),
-    )
-    text = getattr(response, "text", None) or str(response)
-    text = text.strip()
+def _post_dict(topic, text):
+    return {
+        "title": topic,
+        "body_html": text,  # Plain text, kept as body_html for compatibility with publish_via_email
+        "tags": _topic_tags(topic),
+    }
 
-    # Remove any HTML tags that might have been added despite instructions
-    text = re.sub(r'<[^>]+>', '', text)
 
-    # Remove any code fence artifacts at the start/end
-    if text.startswith("```"):
-        text = re.sub(r'^```.*?\n', '', text)
-    if text.endswith("```"):
-        text = re.sub(r'\n```$', '', text)
+def _finalize_post_text(topic, text, model, max_output_tokens, max_continue_attempts=3, full_text=None):
+    """Repair placeholder tokens and truncated output in a generated post body.
 
+    ``full_text``, if given, returns the complete body when ``text`` was cut
+    short at its first placeholder; it is called only if regeneration fails.
+    """
     # Check for literal CODEBLOCK_N placeholders (indicates model failed to generate code)
-    placeholder_pattern = r'\bCODEBLOCK_\d+\b'
-    has_placeholders = re.search(placeholder_pattern, text)
+    has_placeholders = _PLACEHOLDER.search(text)
     logging.info(f"Initial generation check: placeholders found = {bool(has_placeholders)}")
     if has_placeholders:
-        logging.info(f"Placeholder matches: {re.findall(placeholder_pattern, text)}")
-    
-    placeholder_count = 0
-    max_placeholder_attempts = 3
-    while re.search(placeholder_pattern, text) and placeholder_count < max_placeholder_attempts:
-        placeholder_count += 1
+        logging.info(f"Placeholder matches: {_PLACEHOLDER.findall(text)}")
         logging.info(
-            f"[REGEN ATTEMPT {placeholder_count}/{max_placeholder_attempts}] "
-            f"Model generated literal CODEBLOCK_N placeholders instead of real code. "
-            f"Requesting full regeneration."
+            f"[REGEN] Model generated literal CODEBLOCK_N placeholders instead of real code. "
+            f"Requesting {PLACEHOLDER_REGEN_CANDIDATES} full regenerations in one call."
         )
         # Request a complete regeneration with explicit instruction to include code
         regen_prompt = (
@@ -309,34 +835,36 @@ REQUIRED OUTPUT:
             f"Output plain text. NO placeholders. REAL CODE ONLY."
         )
         try:
-            regen_resp = client.models.generate_content(
+            candidates = _generate_candidates(
                 model=model,
                 contents=regen_prompt,
-                config=genai.types.GenerateContentConfig(max_output_tokens=max_output_tokens),
+                config=_generation_config(
+                    max_output_tokens=max_output_tokens,
+                    candidate_count=PLACEHOLDER_REGEN_CANDIDATES,
+                    timeout=_request_timeout(max_output_tokens, PLACEHOLDER_REGEN_CANDIDATES),
+                ),
             )
-            regen_text = getattr(regen_resp, "text", None) or str(regen_resp)
-            regen_text = regen_text.strip()
-            
-            # Check if regeneration produced code or still has placeholders
-            has_regen_placeholders = re.search(placeholder_pattern, regen_text)
-            logging.info(f"[REGEN {placeholder_count}] Result: placeholders_in_response = {bool(has_regen_placeholders)}")
-            
-            if not has_regen_placeholders:
-                logging.info(f"✓ Regeneration {placeholder_count} succeeded - no placeholders detected")
+            # Take the first candidate that produced real code instead of placeholders
+            regen_text = next(
+                (c.strip() for c in candidates if c.strip() and not _PLACEHOLDER.search(c)), None
+            )
+            if regen_text is not None:
+                logging.info(f"✓ Regeneration succeeded - no placeholders in one of {len(candidates)} candidates")
                 text = regen_text
-                break
             else:
-                found_placeholders = re.findall(placeholder_pattern, regen_text)
-                logging.warning(f"[REGEN {placeholder_count}] Still has placeholders: {found_placeholders[:5]}")
+                logging.warning(f"[REGEN] All {len(candidates)} candidates still have placeholders")
         except Exception as e:
-            logging.exception(f"[REGEN {placeholder_count}] Call failed: {e}")
-            break
+            logging.exception(f"[REGEN] Call failed: {e}")
     
-    # If we still have placeholders after retries, use the fallback wrapper
-    final_check = re.search(placeholder_pattern, text)
+    # If we still have placeholders after regeneration, use the fallback wrapper
+    final_check = _PLACEHOLDER.search(text)
+    if final_check and full_text is not None:
+        logging.info("Fetching the complete body that was cut short at its first placeholder")
+        text = full_text()
+        final_check = _PLACEHOLDER.search(text)
     if final_check:
-        found_placeholders = re.findall(placeholder_pattern, text)
-        logging.warning(f"After all regeneration attempts, still have placeholders: {found_placeholders[:5]}. Using fallback wrapping.")
+        found_placeholders = _PLACEHOLDER.findall(text)
+        logging.warning(f"After regeneration, still have placeholders: {found_placeholders[:5]}. Using fallback wrapping.")
         text = _replace_placeholder_tokens_with_fences(text)
     else:
         logging.info("✓ No placeholders in final output - proceeding to conversion")
@@ -351,19 +879,13 @@ REQUIRED OUTPUT:
             "Do NOT repeat what was already written. Output plain text only."
         )
         try:
-            cont_resp = client.models.generate_content(
+            cont_text = _generate_text(
                 model=model,
                 contents=cont_prompt,
-                config=genai.types.GenerateContentConfig(max_output_tokens=800),
+                config=_generation_config(max_output_tokens=800, timeout=_request_timeout(800)),
             )
-            cont_text = getattr(cont_resp, "text", None) or str(cont_resp)
             cont_text = cont_text.strip()
-            # Clean continuation
-            cont_text = re.sub(r'<[^>]+>', '', cont_text)
-            if cont_text.startswith("```"):
-                cont_text = re.sub(r'^```.*?\n', '', cont_text)
-            if cont_text.endswith("```"):
-                cont_text = re.sub(r'\n```$', '', cont_text)
+            cont_text = _clean_model_text(cont_text)
             # Append with a separating newline
             if cont_text:
                 text = text + "\n\n" + cont_text
@@ -371,13 +893,129 @@ REQUIRED OUTPUT:
             logging.exception("Continuation attempt failed")
             break
 
+    return text
+
+
+def iter_topics_and_posts(n_posts=1, model="gemini-2.0-flash", max_output_tokens=4000, max_continue_attempts=3):
+    """Generate ``n_posts`` fresh topics and their blog posts in as few Gemini requests as possible.
+
+    Posts are yielded in order, each as soon as it is ready, so the caller
+    can publish the first while later ones are still being repaired.
+
+    The model returns a JSON array of objects (topic, title, body_html, tags)
+    enforced as ``list[GeneratedPost]``, so the long instruction prompt is
+    paid for once per request instead of twice per post. ``max_output_tokens``
+    is the budget per post; when the posts do not fit in one response they
+    are split into groups requested concurrently. Any post whose entry is
+    missing, or whose topic was already used, is produced by the two-step
+    choose_topic() + generate_post() flow instead; so is every post of a
+    group whose response is not valid JSON.
+    """
+    if n_posts < 1:
+        raise ValueError(f"n_posts must be at least 1, got {n_posts}")
+    categories = _get_next_categories(n_posts)
+
+    used_topics = _load_topic_tracker().get("used_topics", [])
+    topics_text = _format_recent_topics(used_topics)
+
+    group_size = max(1, MODEL_MAX_OUTPUT_TOKENS // max_output_tokens)
+    groups = [categories[i:i + group_size] for i in range(0, len(categories), group_size)]
+    with ThreadPoolExecutor(max_workers=min(len(groups), MAX_CONCURRENT_REQUESTS)) as pool:
+        futures = [
+            pool.submit(_request_topics_and_posts, group, topics_text, model, max_output_tokens)
+            for group in groups
+        ]
+        items = [item for future in futures for item in future.result()]
+
+    jobs = []
+    for category, item in zip(categories, items):
+        try:
+            post = GeneratedPost.model_validate(item)
+        except ValidationError as e:
+            if item is not None:
+                logging.warning(f"Combined generation returned no valid post for {category} ({type(e).__name__}). Falling back to two-step generation.")
+            post = None
+
+        topic = post.topic.strip().strip('"').strip("'") if post else ""
+        if not topic or topic in used_topics or not _record_topic(topic, category):
+            if topic:
+                logging.warning(f"Combined generation returned a used topic: {topic!r}. Falling back to two-step generation.")
+            jobs.append((_generate_topic_and_post_two_step, category, model))
+            continue
+
+        logging.info(f"✓ Generated topic (Category: {category}): {topic}")
+        used_topics.append(topic)
+        jobs.append((_finish_generated_post, topic, post, model, max_output_tokens, max_continue_attempts))
+
+    # Repairs and fallbacks are independent per post, so their Gemini round
+    # trips overlap instead of adding up.
+    with ThreadPoolExecutor(max_workers=min(len(jobs), MAX_CONCURRENT_REQUESTS)) as pool:
+        futures = [pool.submit(*job) for job in jobs]
+        for future in futures:
+            yield future.result()
+
+
+def _request_topics_and_posts(categories, topics_text, model, max_output_tokens):
+    """Ask for one post per category in a single request.
+
+    Returns the raw JSON entries, padded with None to one per category.
+    """
+    categories_text = "\n".join(f"{i}) {category}" for i, category in enumerate(categories, 1))
+    prompt = _TOPICS_AND_POSTS_PROMPT_TMPL.format(
+        n_posts=len(categories), categories=categories_text, recent_topics=topics_text
+    )
+
+    import httpx
+    from google.genai import errors
+
+    output_tokens = min(max_output_tokens * len(categories), MODEL_MAX_OUTPUT_TOKENS)
+    try:
+        text = cached_generate(
+            model,
+            prompt,
+            _generation_config(
+                max_output_tokens=output_tokens,
+                response_mime_type="application/json",
+                response_schema=list[GeneratedPost],
+                timeout=None if BATCH_MODE else _request_timeout(output_tokens),
+            ),
+            POST_CACHE_TTL,
+            batch=BATCH_MODE,
+        )
+    except (httpx.TimeoutException, TimeoutError, errors.APIError) as e:
+        logging.warning("Combined topic+post request failed (%s). Falling back to two-step generation.", e)
+        text = "[]"
+
+    # The schema is enforced server-side; validation only fails on truncated output
+    try:
+        items = _json_loads(text)
+    except json.JSONDecodeError as e:
+        logging.warning("Combined topic+post response was not valid JSON (%s). Falling back to two-step generation.", e)
+        items = []
+    if not isinstance(items, list):
+        items = [items]
+    return (items + [None] * len(categories))[:len(categories)]
+
+
+def _finish_generated_post(topic, post, model, max_output_tokens, max_continue_attempts):
+    """Clean up and repair one post from the combined response."""
+    body = _clean_model_text(post.body_html.strip(), fences=False)
+    body = _finalize_post_text(topic, body, model, max_output_tokens, max_continue_attempts)
+
     return {
-        "title": topic,
-        "body_html": text,  # Plain text, kept as body_html for compatibility with publish_via_email
-        "tags": [t.lower() for t in topic.split()[:4]]
+        "topic": topic,
+        "title": post.title.strip() or topic,
+        "body_html": body,  # Plain text, kept as body_html for compatibility with publish_via_email
+        "tags": [t.lower() for t in post.tags] or _topic_tags(topic),
     }
 
 
+def _generate_topic_and_post_two_step(category, model):
+    """Fallback: generate the topic and the post with separate Gemini calls."""
+    topic = choose_topic(model=model, category=category)
+    return {"topic": topic, **generate_post(topic, model=model)}
+
+
 def run_basic_checks(post):
     """Validate required environment for Gmail transport (only transport supported)."""
     gmail_user = os.getenv("GMAIL_USER")
@@ -388,26 +1026,53 @@ def run_basic_checks(post):
     return True
 
 
-def _convert_markdown_to_plain_and_html(markdown_text: str):
-    """Convert markdown text to HTML for WordPress Post-by-Email rendering.
-    
-    WordPress Post-by-Email recognizes HTML and will render:
-    - <h4>, <h5> tags as headings
-    - <strong> and <em> for bold and italic
-    - <pre><code> for code blocks with styling
-    - <ul><li> for bullet points
-    - Proper line breaks
-    
-    This function converts markdown to HTML so WordPress receives
-    professionally formatted content.
-    """
-    lines = markdown_text.split('\n')
-    html_lines = []
+# HTML fragments emitted by _render_html; the inline styles are what
+# WordPress Post-by-Email keeps when it renders the email body.
+_HEADING_TEMPLATE = '<h5 style="margin: 20px 0 10px 0; color: #222; font-weight: 600; border-bottom: 2px solid #0073aa; padding-bottom: 8px;">{text}</h5>'
+_CODE_TEMPLATE = (
+    '<div style="background: #f5f5f5; border: 1px solid #ddd; border-left: 4px solid #0073aa; '
+    'padding: 12px 15px; margin: 15px 0; border-radius: 3px; overflow-x: auto;">'
+    '<div style="color: #666; font-size: 12px; margin-bottom: 8px; font-weight: bold;">'
+    '{lang}</div>'
+    '<pre style="margin: 0; font-family: monospace; font-size: 13px; line-height: 1.5; white-space: pre-wrap; word-wrap: break-word;">'
+    '<code>{code}</code></pre></div>'
+)
+_LIST_ITEM_TEMPLATE = '<li style="margin: 5px 0;">{text}</li>'
+_PARA_TEMPLATE = '<p style="margin: 10px 0; line-height: 1.6; color: #333;">{text}</p>'
+_LIST_OPEN = '<ul style="margin: 10px 0; padding-left: 30px;">'
+_LIST_CLOSE = '</ul>'
+
+
+_INLINE_CODE_STYLE = ' style="background: #f0f0f0; padding: 2px 4px; border-radius: 2px; font-family: monospace;"'
+
+
+def _format_inline(text, code_style=''):
+    """Convert inline markdown (bold, italic, code) to HTML in a single scan."""
+    # Most lines have no markers at all; skip the regex engine for them
+    if '*' not in text and '`' not in text:
+        return text
+
+    def replace(m):
+        bold_italic, bold, italic, code = m.groups()
+        if code is not None:
+            return f'<code{code_style}>{code}</code>'
+        if bold_italic is not None:
+            return f'<em><strong>{_INLINE.sub(replace, bold_italic)}</strong></em>'
+        if bold is not None:
+            return f'<strong>{_INLINE.sub(replace, bold)}</strong>'
+        return f'<em>{_INLINE.sub(replace, italic)}</em>'
+
+    return _INLINE.sub(replace, text)
+
+
+def _render_html(lines):
+    """Yield the HTML fragments for a sequence of markdown lines."""
     in_code_block = False
     current_code_lang = ''
     current_code_content = []
     in_list = False
-    
+    last = None  # last fragment yielded, for the blank-line <br/> rule
+
     for line in lines:
         # Handle code blocks
         if line.strip().startswith('```'):
@@ -416,126 +1081,177 @@ def _convert_markdown_to_plain_and_html(markdown_text: str):
                 in_code_block = True
                 current_code_lang = line.strip()[3:].strip() or 'text'
                 current_code_content = []
-                continue
             else:
                 # Ending a code block
                 in_code_block = False
                 code_text = '\n'.join(current_code_content)
                 # Escape HTML
-                code_text = code_text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
-                
-                # Create styled code block
-                html_code = (
-                    f'<div style="background: #f5f5f5; border: 1px solid #ddd; border-left: 4px solid #0073aa; '
-                    f'padding: 12px 15px; margin: 15px 0; border-radius: 3px; overflow-x: auto;">'
-                    f'<div style="color: #666; font-size: 12px; margin-bottom: 8px; font-weight: bold;">'
-                    f'{current_code_lang}</div>'
-                    f'<pre style="margin: 0; font-family: monospace; font-size: 13px; line-height: 1.5; white-space: pre-wrap; word-wrap: break-word;">'
-                    f'<code>{code_text}</code></pre></div>'
-                )
-                html_lines.append(html_code)
+                code_text = html.escape(code_text, quote=False)
+                last = _CODE_TEMPLATE.format(lang=current_code_lang, code=code_text)
+                yield last
                 current_code_content = []
-                continue
-        
+            continue
+
         if in_code_block:
             current_code_content.append(line)
             continue
-        
+
         line = line.rstrip()
-        
+
         # Skip empty lines outside of lists
         if not line.strip():
             if in_list:
-                html_lines.append('</ul>')
+                last = _LIST_CLOSE
+                yield last
                 in_list = False
-            elif html_lines and not html_lines[-1].endswith('</p>'):
-                html_lines.append('<br/>')
+            elif last is not None and not last.endswith('</p>'):
+                last = '<br/>'
+                yield last
             continue
-        
+
         # Handle headings: # -> <h2>, ## -> <h3>, ### -> <h3>
         if line.startswith('#'):
             if in_list:
-                html_lines.append('</ul>')
+                yield _LIST_CLOSE
                 in_list = False
-            
-            heading_text = re.sub(r'^#+\s*', '', line).strip()
+
+            heading_text = _HEADING_PREFIX.sub('', line).strip()
             # Convert markdown formatting in heading
-            heading_text = re.sub(r'\*\*([^*]+)\*\*', r'<strong>\1</strong>', heading_text)
-            heading_text = re.sub(r'\*([^*]+)\*', r'<em>\1</em>', heading_text)
-            heading_text = re.sub(r'`([^`]+)`', r'<code>\1</code>', heading_text)
-            
-            html_lines.append(f'<h5 style="margin: 20px 0 10px 0; color: #222; font-weight: 600; border-bottom: 2px solid #0073aa; padding-bottom: 8px;">{heading_text}</h5>')
+            heading_text = _format_inline(heading_text)
+
+            last = _HEADING_TEMPLATE.format(text=heading_text)
+            yield last
             continue
-        
+
         # Handle bullet points
         if line.strip().startswith('*') and not '**' in line:
-            item_text = re.sub(r'^\*\s*', '', line).strip()
+            item_text = _BULLET_PREFIX.sub('', line).strip()
             # Convert markdown formatting
-            item_text = re.sub(r'\*\*([^*]+)\*\*', r'<strong>\1</strong>', item_text)
-            item_text = re.sub(r'\*([^*]+)\*', r'<em>\1</em>', item_text)
-            item_text = re.sub(r'`([^`]+)`', r'<code>\1</code>', item_text)
-            
+            item_text = _format_inline(item_text)
+
             if not in_list:
-                html_lines.append('<ul style="margin: 10px 0; padding-left: 30px;">')
+                yield _LIST_OPEN
                 in_list = True
-            html_lines.append(f'<li style="margin: 5px 0;">{item_text}</li>')
+            last = _LIST_ITEM_TEMPLATE.format(text=item_text)
+            yield last
             continue
-        
+
         # Regular paragraph
         if in_list:
-            html_lines.append('</ul>')
+            yield _LIST_CLOSE
             in_list = False
-        
+
         # Convert markdown formatting to HTML
-        para_text = line
-        # Bold
-        para_text = re.sub(r'\*\*([^*]+)\*\*', r'<strong>\1</strong>', para_text)
-        # Italic
-        para_text = re.sub(r'\*([^*]+)\*', r'<em>\1</em>', para_text)
-        # Inline code
-        para_text = re.sub(r'`([^`]+)`', r'<code style="background: #f0f0f0; padding: 2px 4px; border-radius: 2px; font-family: monospace;">\1</code>', para_text)
-        
-        html_lines.append(f'<p style="margin: 10px 0; line-height: 1.6; color: #333;">{para_text}</p>')
-    
+        para_text = _format_inline(line, code_style=_INLINE_CODE_STYLE)
+
+        last = _PARA_TEMPLATE.format(text=para_text)
+        yield last
+
     # Close any open list
     if in_list:
-        html_lines.append('</ul>')
-    
-    # Build full HTML document
-    html_body = '\n'.join(html_lines)
+        yield _LIST_CLOSE
+
+
+def _convert_markdown_to_html(markdown_text: str) -> str:
+    """Convert markdown text to HTML for WordPress Post-by-Email rendering.
     
-    full_html = f"""<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="utf-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <style>
-        body {{
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, 'Helvetica Neue', Arial, sans-serif;
-            line-height: 1.6;
-            color: #333;
-            max-width: 800px;
-            margin: 0 auto;
-            padding: 20px;
-        }}
-        h2, h3, h4, h5, h6 {{
-            color: #222;
-            font-weight: 600;
-        }}
-        code {{
-            font-family: 'Courier New', monospace;
-        }}
-        pre {{
-            overflow-x: auto;
-        }}
-    </style>
-</head>
-<body>
-{html_body}
-</body>
-</html>"""
+    WordPress Post-by-Email recognizes HTML and will render:
+    - <h4>, <h5> tags as headings
+    - <strong> and <em> for bold and italic
+    - <pre><code> for code blocks with styling
+    - <ul><li> for bullet points
+    - Proper line breaks
     
-    return html_body, full_html
+    This function converts markdown to HTML so WordPress receives
+    professionally formatted content. It returns the body fragment only.
+    """
+    return '\n'.join(_render_html(markdown_text.split('\n')))
+
+
+def _open_smtp_session():
+    """Connect to Gmail SMTP, upgrade to TLS and log in; returns the session."""
+    import smtplib
+    import ssl
+
+    server = smtplib.SMTP("smtp.gmail.com", 587)
+    server.ehlo()
+    # Without an explicit context starttls() skips certificate verification
+    server.starttls(context=ssl.create_default_context())
+    server.ehlo()
+    server.login(os.getenv("GMAIL_USER"), os.getenv("GMAIL_PASS"))
+    return server
+
+
+# Gmail limits how many messages one connection may carry; the shared
+# session is replaced well before that
+SMTP_MAX_MESSAGES_PER_SESSION = 100
+
+_smtp_session = None
+_smtp_messages_sent = 0  # on the current _smtp_session
+
+
+def _get_smtp_session():
+    """Return the shared Gmail SMTP session, reconnecting if it has gone stale.
+
+    One logged-in session serves every post of the run (and the background
+    warm-up in main); it is closed at exit.
+    """
+    global _smtp_session, _smtp_messages_sent
+    if _smtp_session is not None and _smtp_messages_sent >= SMTP_MAX_MESSAGES_PER_SESSION:
+        logging.info("SMTP session sent %d messages; reconnecting", _smtp_messages_sent)
+        _close_smtp_session(_smtp_session)
+        _smtp_session = None
+    if _smtp_session is not None:
+        try:
+            alive = _smtp_session.noop()[0] == 250
+        except Exception:
+            alive = False
+        if not alive:
+            logging.info("SMTP session went stale; reconnecting")
+            _smtp_session = None
+    if _smtp_session is None:
+        _smtp_session = _open_smtp_session()
+        _smtp_messages_sent = 0
+        atexit.register(_close_smtp_session, _smtp_session)
+    return _smtp_session
+
+
+def _send_smtp_message(msg, from_addr, to_addrs):
+    """Send msg over the shared session, reconnecting once if the server dropped it."""
+    global _smtp_messages_sent
+    import smtplib
+
+    try:
+        _get_smtp_session().send_message(msg, from_addr, to_addrs)
+    except smtplib.SMTPServerDisconnected:
+        # The server can drop the session between the ping and the send
+        logging.info("SMTP session was closed by the server; reconnecting")
+        _reset_smtp_session()
+        _get_smtp_session().send_message(msg, from_addr, to_addrs)
+    _smtp_messages_sent += 1
+
+
+def _reset_smtp_session():
+    global _smtp_session
+    _smtp_session = None
+
+
+def _close_smtp_session(server):
+    try:
+        server.quit()
+    except Exception:
+        server.close()
+
+
+def _wait_for_smtp_warmup(future):
+    """Wait for the background login; a failure is retried when sending."""
+    if future is None:
+        return
+    try:
+        future.result()
+    except Exception as e:
+        logging.warning("Background SMTP login failed (%s); will reconnect when sending", e)
+
 
 def publish_via_gmail(post, dry_run=False, show=False, save=False):
     """Send the post via Gmail SMTP to the WP email address as HTML.
@@ -544,27 +1260,35 @@ def publish_via_gmail(post, dry_run=False, show=False, save=False):
     will render with proper styling, headings, bold, italics, and code blocks.
     
     Requires GMAIL_USER and GMAIL_APP_PASSWORD in environment (app password).
+    Sends over the shared session from _get_smtp_session.
     """
+    from email.message import EmailMessage
+
     run_basic_checks(post)
     gmail_user = os.getenv("GMAIL_USER")
-    gmail_pass = os.getenv("GMAIL_PASS")
     to_addr = WP_EMAIL_ADDRESS
 
     title = post.get("title", "Untitled")
     body_text = post.get("body_html", "")  # body_html is actually raw text now
+
+    # Don't send (and create another draft for) a body that was just sent
+    body_hash = _post_hash(body_text)
+    if not dry_run and _was_recently_sent(body_hash):
+        logging.warning("Skipping send: an identical post body was already sent (%s)", body_hash[:12])
+        return {"post_title": title, "to": to_addr, "skipped": True}
     
-    # Convert markdown to HTML
-    _, html_body = _convert_markdown_to_plain_and_html(body_text)
-    
-    # Extract just the body content from the HTML
-    body_match = re.search(r'<body>(.*?)</body>', html_body, re.DOTALL)
-    html_content = body_match.group(1).strip() if body_match else html_body
+    # Convert markdown to HTML; only the body fragment goes into the email
+    html_content = _convert_markdown_to_html(body_text)
     
     # Add title as h4 at the top
     email_html = f'<h4 style="color: #222; font-size: 28px; margin: 0 0 20px 0;">{title}</h4>\n{html_content}'
 
     # Build MIME message as HTML
-    msg = MIMEText(email_html, 'html', _charset='utf-8')
+    # set_content sends the body quoted-printable instead of base64: the
+    # <h4>/<p style=...> lines exceed the policy's 78-character limit, and
+    # quoted-printable keeps the HTML readable and barely larger than the text
+    msg = EmailMessage()
+    msg.set_content(email_html, subtype='html', charset='utf-8')
     msg['Subject'] = title
     msg['From'] = gmail_user
     msg['To'] = to_addr
@@ -599,17 +1323,9 @@ def publish_via_gmail(post, dry_run=False, show=False, save=False):
         return {"post_title": title, "to": to_addr, "dry_run": True}
 
     try:
-        server = smtplib.SMTP("smtp.gmail.com", 587)
-        server.ehlo()
-        server.starttls()
-        server.ehlo()
-        server.login(gmail_user, gmail_pass)
-        
-        # server = smtplib.SMTP_SSL("smtp.gmail.com", 465, timeout=30)
-        # server.login(gmail_user, gmail_pass)
-        server.sendmail(gmail_user, [to_addr], msg.as_string())
-        server.quit()
+        _send_smtp_message(msg, gmail_user, [to_addr])
         logging.info("✓ Email sent successfully via Gmail SMTP (HTML with proper formatting)")
+        _remember_sent_post(body_hash)
         return {"post_title": title, "to": to_addr}
     except Exception as e:
         logging.error("Error sending email via Gmail: %s", e)
@@ -625,17 +1341,26 @@ def main():
     args = parser.parse_args()
 
     logging.info("Starting auto-post flow")
-    topic = choose_topic()
-    logging.info("Topic: %s", topic)
-    post = generate_post(topic)
-    logging.info("Generated post")
-
-    # Publish via Gmail SMTP to WordPress Post-by-Email
-    result = publish_via_gmail(post, dry_run=args.dry_run, show=args.show, save=args.save)
-
-    with open("publish_log.jsonl", "a") as f:
-        f.write(json.dumps({"topic": topic, "result": result, "ts": int(time.time())}) + "\n")
-    logging.info("Done. Result: %s", result)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        # Connect and log in to Gmail while Gemini generates the post. Batch
+        # jobs can take far longer than an idle SMTP session survives.
+        smtp_future = None
+        if not args.dry_run and not BATCH_MODE:
+            smtp_future = pool.submit(_get_smtp_session)
+
+        # Publish each post as soon as it is ready; later posts keep
+        # generating on worker threads meanwhile
+        for post in iter_topics_and_posts(N_POSTS_PER_RUN):
+            _wait_for_smtp_warmup(smtp_future)
+            smtp_future = None
+            topic = post["topic"]
+            logging.info("Topic: %s", topic)
+
+            # Publish via Gmail SMTP to WordPress Post-by-Email
+            result = publish_via_gmail(post, dry_run=args.dry_run, show=args.show, save=args.save)
+
+            _append_publish_log({"topic": topic, "result": result, "ts": int(time.time())})
+            logging.info("Done. Result: %s", result)
 
 
 if __name__ == "__main__":